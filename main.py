@@ -1,7 +1,17 @@
 import sys
 import os
+import errno
 import json
 import shutil
+import threading
+import time
+import hashlib
+import tarfile
+import zipfile
+import gc
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from datetime import date
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout,
@@ -9,7 +19,7 @@ from PyQt5.QtWidgets import (
     QMenu, QAction, QMessageBox, QDialog, QLineEdit,
     QFormLayout, QDialogButtonBox, QFileDialog
 )
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import (
     QIcon, QFont, QDragEnterEvent, QDropEvent,
     QColor, QPen, QPixmap, QPainter
@@ -98,6 +108,1725 @@ def save_config_file(config):
         print(f"保存配置失败: {e}")
 
 
+# ===================== 文件移动 & 磁盘空间准入控制 =====================
+
+# 一次移动任务：源文件、目标文件夹、目标所在设备、为它预留的字节数，
+# 以及附加目标 ((文件夹, 设备, 预留字节数), ...)
+SpaceJob = namedtuple("SpaceJob", ["file_path", "target_folder", "device", "nbytes", "extras"])
+
+
+def rule_folders(rule):
+    """规则的值可以是一个文件夹，也可以是多个文件夹组成的列表（同一文件归档到多处）"""
+    if isinstance(rule, str):
+        rule = [rule]
+    return [folder.strip() for folder in rule or [] if folder and folder.strip()]
+
+
+def get_target_folders(file_path, file_types):
+    """根据扩展名查找全部目标文件夹，没有对应规则时返回空列表"""
+    file_extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+    return rule_folders(file_types.get(file_extension))
+
+
+def get_target_folder(file_path, file_types):
+    """根据扩展名查找主目标文件夹，没有对应规则时返回 None"""
+    folders = get_target_folders(file_path, file_types)
+    return folders[0] if folders else None
+
+
+def get_existing_ancestor(path):
+    """目标文件夹可能还没创建，向上找到最近一个已存在的目录"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def get_device_id(path):
+    """返回 path（或其最近的已存在上级目录）所在设备的编号"""
+    return os.stat(get_existing_ancestor(path)).st_dev
+
+
+def unique_target_path(target_folder, file_name):
+    """如果目标文件已存在，添加序号"""
+    target_path = os.path.join(target_folder, file_name)
+    counter = 1
+    base_name, ext = os.path.splitext(file_name)
+    while os.path.exists(target_path):
+        target_path = os.path.join(target_folder, f"{base_name}_{counter}{ext}")
+        counter += 1
+    return target_path
+
+
+def create_unique(target_folder, file_name, create):
+    """
+    按 unique_target_path 的规则挑名字，用 create(路径) 独占地创建目标，返回最终路径。
+    create 在目标已存在时必须抛 FileExistsError（os.link / os.symlink / O_EXCL 都是这样），
+    这样后台迁移线程和分类流程同时挑到同一个名字时，后到的一方会换下一个序号，不会互相覆盖。
+    """
+    base_name, ext = os.path.splitext(file_name)
+    target_path = os.path.join(target_folder, file_name)
+    counter = 1
+    while True:
+        try:
+            create(target_path)
+            return target_path
+        except FileExistsError:
+            target_path = os.path.join(target_folder, f"{base_name}_{counter}{ext}")
+            counter += 1
+
+
+def _create_placeholder(path):
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+
+
+def reserve_target_path(target_folder, file_name):
+    """在目标文件夹里独占地创建一个空的占位文件，返回它的路径，之后可以安全地覆盖它"""
+    return create_unique(target_folder, file_name, _create_placeholder)
+
+
+def move_file_to_folder(file_path, target_folder):
+    """
+    把文件移动到目标文件夹，返回最终路径。
+    先独占创建占位文件再用 os.replace 覆盖它，所以并发的移动不会抢到同一个名字；
+    跨磁盘时改为复制到占位文件再删除源文件，复制中途失败（例如磁盘写满）会清理掉半截文件。
+    符号链接按原指向重新创建。
+    """
+    os.makedirs(target_folder, exist_ok=True)
+    file_name = os.path.basename(file_path)
+    if os.path.islink(file_path):
+        link = os.readlink(file_path)
+        target_path = create_unique(target_folder, file_name, lambda path: os.symlink(link, path))
+        os.remove(file_path)
+        return target_path
+
+    target_path = reserve_target_path(target_folder, file_name)
+    try:
+        try:
+            os.replace(file_path, target_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copy2(file_path, target_path)
+            os.remove(file_path)
+    except Exception:
+        if os.path.exists(file_path) and os.path.exists(target_path):
+            try:
+                os.remove(target_path)
+            except OSError:
+                pass
+        raise
+    return target_path
+
+
+# Linux 上 btrfs / XFS 等文件系统支持的 FICLONE ioctl（reflink，写时复制）
+FICLONE = 0x40049409
+
+
+def _reflink(source_path, target_path):
+    """用 reflink 克隆文件，只复制元数据；不支持时抛出 OSError"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "当前平台不支持 reflink")
+    with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target_path)
+            raise
+
+
+def link_file_to_folder(source_path, target_folder, mode="link", reserved=False, headroom=0):
+    """
+    把已经归档好的 source_path 再放一份到 target_folder，返回 (最终路径, 放置方式)。
+
+    mode="link"（默认）依次尝试：同一磁盘的硬链接 → reflink 克隆 → 符号链接，
+    都不行才真正复制；mode="copy" 直接复制。
+    复制所需空间通常已由 admit_batch 预留（reserved=True）；没有预留时在这里
+    按同样的 headroom 向 SPACE_LEDGER 申请，放不下就报 ENOSPC，不留半截文件。
+    """
+    os.makedirs(target_folder, exist_ok=True)
+    file_name = os.path.basename(source_path)
+
+    if mode != "copy":
+        try:
+            return create_unique(target_folder, file_name, lambda path: os.link(source_path, path)), "hardlink"
+        except OSError:
+            pass
+        target_path = reserve_target_path(target_folder, file_name)
+        try:
+            _reflink(source_path, target_path)
+            return target_path, "reflink"
+        except OSError:
+            try:
+                os.remove(target_path)
+            except OSError:
+                pass
+        # 符号链接指向主目标的绝对路径；规则迁移挪走主目标后由 RuleMigration 重新指向
+        source = os.path.abspath(source_path)
+        try:
+            return create_unique(target_folder, file_name, lambda path: os.symlink(source, path)), "symlink"
+        except (OSError, NotImplementedError):
+            pass
+
+    device = get_device_id(target_folder)
+    nbytes = 0 if reserved else os.path.getsize(source_path)
+    if not SPACE_LEDGER.try_reserve(device, get_existing_ancestor(target_folder), nbytes, headroom):
+        raise OSError(errno.ENOSPC, "目标磁盘空间不足", target_folder)
+    try:
+        target_path = reserve_target_path(target_folder, file_name)
+        try:
+            shutil.copy2(source_path, target_path)
+        except Exception:
+            try:
+                os.remove(target_path)
+            except OSError:
+                pass
+            raise
+    finally:
+        SPACE_LEDGER.release(device, nbytes)
+    return target_path, "copy"
+
+
+class SpaceLedger:
+    """
+    进程内的磁盘空间预留账本。
+    多个批次可能同时往同一块盘上复制，只看 disk_usage 会重复计算同一份空闲空间，
+    所以每个批次开始前先在这里“占座”，文件移动结束后再归还。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reserved = {}
+
+    def try_reserve(self, device, probe_path, nbytes, headroom=0):
+        """空闲空间 - 已预留 - 保留余量 足够时预留 nbytes 并返回 True"""
+        if nbytes <= 0:
+            return True
+        with self._lock:
+            try:
+                free = shutil.disk_usage(probe_path).free
+            except OSError:
+                return False
+            reserved = self._reserved.get(device, 0)
+            if free - reserved - headroom < nbytes:
+                return False
+            self._reserved[device] = reserved + nbytes
+            return True
+
+    def release(self, device, nbytes):
+        if nbytes <= 0:
+            return
+        with self._lock:
+            left = self._reserved.get(device, 0) - nbytes
+            if left > 0:
+                self._reserved[device] = left
+            else:
+                self._reserved.pop(device, None)
+
+    def reserved(self, device):
+        with self._lock:
+            return self._reserved.get(device, 0)
+
+
+SPACE_LEDGER = SpaceLedger()
+
+
+def space_headroom(config):
+    """每块磁盘上要保留的余量（space_settings.reserve_mb），单位字节"""
+    return int(config.get("space_settings", {}).get("reserve_mb", 256)) * 1024 * 1024
+
+
+def _job_for(file_path, target_folder, extra_folders=(), config=None):
+    """
+    计算一个文件移动到 target_folder 实际需要的空间：
+    同一设备上的移动只是重命名，不占额外空间，记为 0。
+    附加目标和主目标不在同一块盘（硬链接 / reflink 做不到），或 placement_mode 为 copy 时，
+    按复制一整份计算；附加目标不可用时记为 0，放置时再单独报错。
+    命中 pack_rules 的文件要等归档提交后才删除源文件，主目标按一整份计算，附加目标只写引用记为 0。
+    """
+    device = get_device_id(target_folder)
+    try:
+        st = os.stat(file_path)
+        size = st.st_size
+        nbytes = 0 if st.st_dev == device else size
+    except OSError:
+        size = nbytes = 0
+
+    if get_pack_policy(file_path, config or {}) is not None:
+        extras = tuple((folder, None, 0) for folder in extra_folders)
+        return SpaceJob(file_path, target_folder, device, size, extras)
+
+    copy_mode = (config or {}).get("placement_mode", "link") == "copy"
+    extras = []
+    for folder in extra_folders:
+        try:
+            extra_device = get_device_id(folder)
+        except OSError:
+            extras.append((folder, None, 0))
+            continue
+        extras.append((folder, extra_device, size if copy_mode or extra_device != device else 0))
+    return SpaceJob(file_path, target_folder, device, nbytes, tuple(extras))
+
+
+def _job_charges(job):
+    """一个任务需要在各设备上预留的空间：[(设备, 探测路径, 字节数)]"""
+    charges = [(job.device, job.target_folder, job.nbytes)]
+    charges.extend((device, folder, nbytes) for folder, device, nbytes in job.extras if nbytes)
+    return charges
+
+
+def _reserve_job(ledger, job, headroom):
+    """为一个任务的所有目标预留空间，任何一处放不下就全部退回"""
+    done = []
+    for device, folder, nbytes in _job_charges(job):
+        if not ledger.try_reserve(device, get_existing_ancestor(folder), nbytes, headroom):
+            for device_done, nbytes_done in done:
+                ledger.release(device_done, nbytes_done)
+            return False
+        done.append((device, nbytes))
+    return True
+
+
+def release_job(job, ledger=SPACE_LEDGER):
+    """任务结束（无论成败）后归还它预留的空间"""
+    for device, _, nbytes in _job_charges(job):
+        ledger.release(device, nbytes)
+
+
+def admit_batch(jobs, config, ledger=SPACE_LEDGER):
+    """
+    在任何 I/O 开始前，按目标设备汇总本批次要写入的字节数（包括附加目标需要复制的部分），
+    和 disk_usage 对比并预留空间。
+
+    jobs: [(file_path, target_folder) 或 (file_path, target_folder, extra_folders), ...]
+    返回 (admitted, refused)，admitted 为 SpaceJob 列表（已在 ledger 中预留，
+    结束后需要 release_job），refused 为放不下或目标不可用的 (file_path, target_folder)。
+
+    - 各设备的总量都放得下：一次性预留；
+    - 放不下：按拖入顺序逐个预留，能放多少放多少（裁剪）；
+    - 仍放不下的文件，如果配置了 space_settings.overflow_folder，主目标改投到那里；
+    - 都不行就拒绝，不产生任何复制。
+    """
+    headroom = space_headroom(config)
+    overflow_folder = config.get("space_settings", {}).get("overflow_folder", "").strip()
+
+    planned = []
+    refused = []
+    for file_path, target_folder, *rest in jobs:
+        # 单个文件的目标不可用（例如规则指向一块没插上的盘）只拒绝这个文件
+        try:
+            planned.append(_job_for(file_path, target_folder, rest[0] if rest else (), config))
+        except OSError:
+            refused.append((file_path, target_folder))
+
+    totals = {}
+    probes = {}
+    for job in planned:
+        for device, folder, nbytes in _job_charges(job):
+            totals[device] = totals.get(device, 0) + nbytes
+            probes.setdefault(device, folder)
+
+    reserved = []
+    for device, total in totals.items():
+        if not ledger.try_reserve(device, get_existing_ancestor(probes[device]), total, headroom):
+            break
+        reserved.append((device, total))
+    else:
+        return planned, refused
+
+    for device, total in reserved:
+        ledger.release(device, total)
+
+    admitted = []
+    leftovers = []
+    for job in planned:
+        if _reserve_job(ledger, job, headroom):
+            admitted.append(job)
+        else:
+            leftovers.append(job)
+
+    for job in leftovers:
+        if overflow_folder:
+            try:
+                rerouted = _job_for(job.file_path, overflow_folder,
+                                    [folder for folder, _, _ in job.extras], config)
+            except OSError:
+                rerouted = None
+            if rerouted is not None and _reserve_job(ledger, rerouted, headroom):
+                admitted.append(rerouted)
+                continue
+        refused.append((job.file_path, job.target_folder))
+
+    return admitted, refused
+
+
+# ===================== 资源预算（托盘常驻进程的内存 / 句柄 / 线程上限） =====================
+
+DEFAULT_RESOURCE_LIMITS = {
+    "max_cache_mb": 32,         # 各类缓存加起来的内存上限
+    "max_rss_mb": 200,          # 进程常驻内存预算，超出时清空所有缓存并回收
+    "max_queued_items": 1000,   # 内存里最多排队的待分类文件，多出来的写到磁盘
+    "max_open_files": 32,       # 归档 / 索引等长期打开的文件句柄上限
+    "max_worker_threads": 2,    # 后台线程（统计校准、规则迁移）上限
+}
+
+QUEUE_SPOOL_NAME = "queue.spool"
+
+
+def get_process_rss():
+    """当前进程的常驻内存（字节），取不到时返回 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        pass
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except Exception:
+            pass
+        return None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+class ResourceGovernor:
+    """
+    fileHome 会在托盘里一挂好几周，这里统一管着各处的资源上限（config.json 中的 resource_limits）：
+
+    - 缓存：通过 register_cache 注册，缓存对象需要提供 cache_bytes() / trim_cache(max_bytes)，
+      可选提供 open_files()；超出 max_cache_mb 时从最大的缓存开始按 LRU 淘汰；
+    - 进程内存：常驻内存超过 max_rss_mb 时清空全部缓存并 gc；窗口每分钟检查一次；
+    - 排队：SpillQueue 按 max_queued_items 决定内存里留多少，其余落盘；
+    - 后台线程：统一通过 start_thread 启动，超过 max_worker_threads 时不启动，由调用方稍后重试。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = []
+        self._threads = 0
+        self.limits = dict(DEFAULT_RESOURCE_LIMITS)
+
+    def configure(self, config):
+        limits = dict(DEFAULT_RESOURCE_LIMITS)
+        for key, value in config.get("resource_limits", {}).items():
+            if key in limits:
+                try:
+                    limits[key] = max(1, int(value))
+                except (TypeError, ValueError):
+                    print(f"resource_limits.{key} 配置无效: {value}")
+        self.limits = limits
+        self.enforce()
+
+    def register_cache(self, cache):
+        self._caches.append(cache)
+
+    def cache_bytes(self):
+        return sum(cache.cache_bytes() for cache in self._caches)
+
+    def open_files(self):
+        return sum(cache.open_files() for cache in self._caches if hasattr(cache, "open_files"))
+
+    def enforce(self):
+        """缓存总量超出预算时，从占用最大的缓存开始裁剪；常驻内存超出预算时清空全部缓存"""
+        budget = self.limits["max_cache_mb"] * 1024 * 1024
+        excess = self.cache_bytes() - budget
+        if excess > 0:
+            for cache in sorted(self._caches, key=lambda c: -c.cache_bytes()):
+                used = cache.cache_bytes()
+                cache.trim_cache(max(0, used - excess))
+                excess -= used - cache.cache_bytes()
+                if excess <= 0:
+                    break
+
+        rss = get_process_rss()
+        if rss is not None and rss > self.limits["max_rss_mb"] * 1024 * 1024:
+            self.trim_caches()
+
+    def trim_caches(self):
+        """窗口隐藏到托盘时清空所有可重建的缓存"""
+        for cache in self._caches:
+            cache.trim_cache(0)
+        gc.collect()
+
+    def start_thread(self, target, name, *args):
+        """线程数没超上限时启动后台线程并返回它，否则返回 None"""
+        with self._lock:
+            if self._threads >= self.limits["max_worker_threads"]:
+                return None
+            self._threads += 1
+
+        def run():
+            try:
+                target(*args)
+            finally:
+                with self._lock:
+                    self._threads -= 1
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def usage(self):
+        """当前资源占用，用于界面上的实时读数"""
+        with self._lock:
+            threads = self._threads
+        return {
+            "rss": get_process_rss(),
+            "cache_bytes": self.cache_bytes(),
+            "open_files": self.open_files(),
+            "worker_threads": threads,
+        }
+
+
+RESOURCE_GOVERNOR = ResourceGovernor()
+
+
+class SpillQueue:
+    """
+    待分类文件队列：内存里最多放 max_items 个路径，多出来的按顺序追加到磁盘上的 spool 文件，
+    内存里的取完后再从 spool 里按顺序读回来。一次拖进几万个文件也不会把路径全堆在内存里。
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._memory = deque()
+        self._spilled = 0
+        self._read_pos = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._memory) + self._spilled
+
+    @property
+    def in_memory(self):
+        return len(self._memory)
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    def clear(self):
+        self._memory.clear()
+        self._spilled = 0
+        self._read_pos = 0
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    def extend(self, items, max_items):
+        spool = None
+        try:
+            for item in items:
+                # 一旦开始落盘，后来的也要排到盘上，保证先进先出
+                if not self._spilled and len(self._memory) < max_items:
+                    self._memory.append(item)
+                    continue
+                if spool is None:
+                    spool = open(self._path, "ab")
+                spool.write(item.encode("utf-8") + b"\n")
+                self._spilled += 1
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def pop_chunk(self, n):
+        if not self._memory and self._spilled:
+            self._refill(n)
+        chunk = []
+        while self._memory and len(chunk) < n:
+            chunk.append(self._memory.popleft())
+        return chunk
+
+    def _refill(self, n):
+        with open(self._path, "rb") as spool:
+            spool.seek(self._read_pos)
+            while self._spilled and len(self._memory) < n:
+                line = spool.readline()
+                if not line:
+                    self._spilled = 0
+                    break
+                self._memory.append(line.rstrip(b"\n").decode("utf-8"))
+                self._spilled -= 1
+            self._read_pos = spool.tell()
+        if not self._spilled:
+            self._read_pos = 0
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
+# ===================== 小文件打包（滚动归档） =====================
+
+PACK_INDEX_NAME = "_packed_index.jsonl"
+
+
+def get_pack_policy(file_path, config):
+    """
+    返回该文件适用的打包策略（config.json 中 pack_rules 按扩展名配置）；
+    没有配置或文件不够小时返回 None。
+
+    策略字段：
+        max_file_kb     小于这个大小的文件才打包，默认 64
+        format          zip 或 tar，默认 zip
+        max_archive_mb  单个归档的大小上限，超过就滚动到下一个，默认 256
+        max_members     单个归档的文件数上限，默认 10000
+        compress        zip 是否压缩，默认 False（图片、图标多半已压缩过）
+    """
+    file_extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+    policy = config.get("pack_rules", {}).get(file_extension)
+    if not isinstance(policy, dict):
+        return None
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return None
+    return policy if size < int(policy.get("max_file_kb", 64)) * 1024 else None
+
+
+def read_pack_entries(folder):
+    """
+    读取文件夹下的打包索引，返回条目列表，每条包含：
+        name     原文件名
+        member   归档内的名字（重名时会加序号）
+        archive  归档的完整路径（附加目标里的条目指向主目标的归档）
+        size     原文件大小
+    """
+    entries = []
+    index_path = os.path.join(folder, PACK_INDEX_NAME)
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entry.setdefault("member", entry.get("name"))
+                entry["archive"] = os.path.join(folder, entry["archive"])
+                entries.append(entry)
+    except OSError:
+        pass
+    return entries
+
+
+def read_pack_index(folder):
+    """返回 {原文件名: (归档路径, 归档内名字)}，同名文件以最后一次打包的为准"""
+    return {entry["name"]: (entry["archive"], entry["member"]) for entry in read_pack_entries(folder)}
+
+
+def find_packed_file(folder, name):
+    """按原文件名（找不到时按归档内名字）查找被打包的文件，返回 (归档路径, 归档内名字) 或 None"""
+    entries = read_pack_entries(folder)
+    for key in ("name", "member"):
+        for entry in reversed(entries):
+            if entry[key] == name:
+                return entry["archive"], entry["member"]
+    return None
+
+
+def extract_packed_file(folder, name, dest_folder):
+    """把打包的文件按原文件名解出到 dest_folder，返回解出后的路径"""
+    found = find_packed_file(folder, name)
+    if found is None:
+        raise FileNotFoundError(errno.ENOENT, "归档索引中没有这个文件", name)
+    archive_path, member = found
+    os.makedirs(dest_folder, exist_ok=True)
+    target_path = reserve_target_path(dest_folder, name)
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zf, zf.open(member) as src, open(target_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    else:
+        with tarfile.open(archive_path) as tf:
+            src = tf.extractfile(member)
+            with src, open(target_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+    return target_path
+
+
+def _fsync_path(path):
+    with open(path, "ab") as f:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SmallFilePacker:
+    """
+    把大量小文件写进目标文件夹里的滚动归档 _packed_<扩展名>_NNNN.zip/tar，
+    同一文件夹下的 _packed_index.jsonl 记录“原文件名 → 所在归档和归档内名字”。
+    几万个 4KB 文件就变成了几个大文件，NTFS / SMB 上快得多。
+
+    已经完成的归档从不原地追加：每个批次写的是 .part 临时归档，批次结束时
+    close_all() 关闭、fsync 后再改名到位，然后写索引并 fsync，最后才删除源文件。
+    中途崩溃最多留下一个 .part（下次打开时清理），源文件和已有归档都不受影响。
+    已有归档不超过 PACK_REWRITE_MB 且没写满时，会复制一份到 .part 接着写，
+    否则直接开一个新编号，避免每个批次都整份复制大归档。
+
+    附加目标不再重复打包，只在它的索引里写一条指向主目标归档的引用。
+    同时打开的归档数超过 resource_limits.max_open_files 时先提交最久没用的。
+    文件名集合是可以从索引重建的缓存，受 ResourceGovernor 的内存预算约束。
+    """
+
+    # 估算文件名集合中每一项除字符串本身外的开销（哈希表槽位）
+    NAME_OVERHEAD = 32
+    PACK_REWRITE_MB = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writers = OrderedDict()   # (folder, ext) -> 当前正在写的归档状态
+        self._names = OrderedDict()     # folder -> 已占用的归档内名字（用于去重）
+        self._names_bytes = {}          # folder -> 该集合估算占用的字节数
+        self._errors = []               # 提前提交（句柄超限）时的错误，close_all 时一起返回
+
+    def add(self, file_path, target_folder, policy, extra_folders=()):
+        """
+        把文件写进 target_folder 的临时归档，返回 (归档最终路径, 归档内名字)。
+        源文件和索引要等 close_all() 提交成功后才处理；extra_folders 届时写入引用条目。
+        """
+        file_extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+        size = os.path.getsize(file_path)
+        max_bytes = int(policy.get("max_archive_mb", 256)) * 1024 * 1024
+        max_members = int(policy.get("max_members", 10000))
+
+        with self._lock:
+            os.makedirs(target_folder, exist_ok=True)
+            names = self._names.get(target_folder)
+            if names is None:
+                names = self._names[target_folder] = {
+                    entry["member"] for entry in read_pack_entries(target_folder)
+                }
+                self._names_bytes[target_folder] = sum(
+                    sys.getsizeof(name) + self.NAME_OVERHEAD for name in names
+                )
+            self._names.move_to_end(target_folder)
+
+            key = (target_folder, file_extension)
+            writer = self._writers.get(key)
+            if writer is None:
+                writer = self._open_writer(target_folder, file_extension, policy, 0)
+            if writer["count"] >= max_members or (writer["count"] and writer["size"] + size > max_bytes):
+                self._errors.extend(self._commit(writer))
+                writer = self._open_writer(target_folder, file_extension, policy, writer["number"] + 1)
+            self._writers[key] = writer
+            self._writers.move_to_end(key)
+
+            original = os.path.basename(file_path)
+            member = original
+            base_name, ext = os.path.splitext(original)
+            counter = 1
+            while member in names:
+                member = f"{base_name}_{counter}{ext}"
+                counter += 1
+
+            if writer["format"] == "zip":
+                compress = zipfile.ZIP_DEFLATED if policy.get("compress") else zipfile.ZIP_STORED
+                writer["archive"].write(file_path, arcname=member, compress_type=compress)
+            else:
+                writer["archive"].add(file_path, arcname=member)
+            writer["count"] += 1
+            writer["size"] += size
+            writer["pending"].append({
+                "source": file_path, "name": original, "member": member,
+                "size": size, "extras": list(extra_folders),
+            })
+            names.add(member)
+            self._names_bytes[target_folder] += sys.getsizeof(member) + self.NAME_OVERHEAD
+
+            self._limit_open_files()
+            return writer["path"], member
+
+    def _limit_open_files(self):
+        """超过句柄上限时提前提交最久没用的归档（刚用过的排在最后，不会被提交）"""
+        max_open = RESOURCE_GOVERNOR.limits["max_open_files"]
+        while len(self._writers) > max(1, max_open):
+            _, writer = self._writers.popitem(last=False)
+            self._errors.extend(self._commit(writer))
+
+    def open_files(self):
+        return len(self._writers)
+
+    def cache_bytes(self):
+        return sum(self._names_bytes.values())
+
+    def trim_cache(self, max_bytes):
+        """
+        按 LRU 丢掉文件名集合，直到不超过 max_bytes；下次用到时再从索引读回来。
+        还有归档没提交的文件夹不能丢：未提交的名字还不在索引里。
+        """
+        with self._lock:
+            busy = {folder for folder, _ in self._writers}
+            for folder in list(self._names):
+                if sum(self._names_bytes.values()) <= max_bytes:
+                    break
+                if folder in busy:
+                    continue
+                del self._names[folder]
+                self._names_bytes.pop(folder, None)
+
+    def _open_writer(self, folder, file_extension, policy, number):
+        """
+        在 .part 临时文件上打开编号不小于 number 的归档。
+        编号相同的已有归档又小又没写满时复制过来接着写，否则开新编号。
+        """
+        fmt = "tar" if policy.get("format") == "tar" else "zip"
+        prefix = f"_packed_{file_extension}_"
+        existing = []
+        for entry in os.scandir(folder):
+            name = entry.name
+            if not name.startswith(prefix):
+                continue
+            if name.endswith(".part"):
+                # 上次崩溃留下的临时归档，对应的源文件还在，直接清理
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif name.endswith("." + fmt):
+                digits = name[len(prefix):-len(fmt) - 1]
+                if digits.isdigit():
+                    existing.append(int(digits))
+        number = max([number] + existing)
+
+        path = os.path.join(folder, f"{prefix}{number:04d}.{fmt}")
+        part = path + ".part"
+        count = 0
+        if os.path.exists(path):
+            max_members = int(policy.get("max_members", 10000))
+            max_bytes = int(policy.get("max_archive_mb", 256)) * 1024 * 1024
+            size = os.path.getsize(path)
+            try:
+                if fmt == "zip":
+                    with zipfile.ZipFile(path) as zf:
+                        count = len(zf.infolist())
+                else:
+                    with tarfile.open(path) as tf:
+                        count = len(tf.getmembers())
+                reusable = (count < max_members and size < max_bytes
+                            and size <= self.PACK_REWRITE_MB * 1024 * 1024)
+            except Exception:
+                reusable = False
+            if reusable:
+                shutil.copyfile(path, part)
+            else:
+                number += 1
+                path = os.path.join(folder, f"{prefix}{number:04d}.{fmt}")
+                part = path + ".part"
+                count = 0
+
+        if fmt == "zip":
+            archive = zipfile.ZipFile(part, "a" if count else "w")
+        else:
+            archive = tarfile.open(part, "a" if count else "w")
+        size = os.path.getsize(part) if os.path.exists(part) else 0
+        return {"archive": archive, "path": path, "part": part, "format": fmt,
+                "number": number, "count": count, "size": size, "pending": []}
+
+    def _commit(self, writer):
+        """
+        提交一个临时归档：关闭并 fsync → 改名到位 → 写索引并 fsync → 计入统计 → 删除源文件。
+        返回 [(源文件, 异常)]；失败时源文件保持原样。
+        """
+        pending = writer["pending"]
+        try:
+            writer["archive"].close()
+            if not pending:
+                os.remove(writer["part"])
+                return []
+            _fsync_path(writer["part"])
+            os.replace(writer["part"], writer["path"])
+        except Exception as e:
+            try:
+                os.remove(writer["part"])
+            except OSError:
+                pass
+            return [(entry["source"], e) for entry in pending]
+
+        folder = os.path.dirname(writer["path"])
+        archive_name = os.path.basename(writer["path"])
+        lines = {}
+        for entry in pending:
+            record = {"name": entry["name"], "member": entry["member"], "size": entry["size"]}
+            lines.setdefault(folder, []).append(dict(record, archive=archive_name))
+            for extra in entry["extras"]:
+                # 附加目标只记一条引用，归档路径写成绝对路径
+                lines.setdefault(extra, []).append(dict(record, archive=os.path.abspath(writer["path"])))
+
+        errors = []
+        for index_folder, records in lines.items():
+            index_path = os.path.join(index_folder, PACK_INDEX_NAME)
+            try:
+                os.makedirs(index_folder, exist_ok=True)
+                with open(index_path, "a", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                if index_folder == folder:
+                    # 主索引没写成，归档里多出的条目没人引用；保留源文件，下次重新打包
+                    return [(entry["source"], e) for entry in pending]
+                errors.append((index_folder, e))
+
+        failed_extras = {index_folder for index_folder, _ in errors}
+        for entry in pending:
+            file_extension = os.path.splitext(entry["name"])[1].lower().lstrip('.')
+            USAGE_STATS.record(folder, file_extension, entry["size"])
+            for extra in entry["extras"]:
+                if extra not in failed_extras:
+                    # 同一个源文件只计入一次当天归档量和扩展名统计
+                    USAGE_STATS.record(extra, file_extension, entry["size"], intake=False)
+            try:
+                os.remove(entry["source"])
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors.append((entry["source"], e))
+        return errors
+
+    def relocate(self, file_extension, old_folder, new_folder):
+        """
+        规则变更时把某个扩展名的归档从 old_folder 挪到 new_folder，并拆分索引。
+        返回 (挪过去的 [(原文件名, 大小)], {旧归档路径: 新归档路径})，后者用来修正别处的引用。
+        """
+        moved = []
+        archives = {}
+        with self._lock:
+            writer = self._writers.pop((old_folder, file_extension), None)
+            if writer is not None:
+                self._errors.extend(self._commit(writer))
+            for folder in (old_folder, new_folder):
+                self._names.pop(folder, None)
+                self._names_bytes.pop(folder, None)
+
+            prefix = f"_packed_{file_extension}_"
+            renamed = {}
+            try:
+                entries = [e.name for e in os.scandir(old_folder)
+                           if e.name.startswith(prefix) and not e.name.endswith(".part")]
+            except OSError:
+                return moved, archives
+            os.makedirs(new_folder, exist_ok=True)
+            for name in entries:
+                old_path = os.path.join(old_folder, name)
+                target_path = move_file_to_folder(old_path, new_folder)
+                renamed[name] = os.path.basename(target_path)
+                archives[os.path.abspath(old_path)] = os.path.abspath(target_path)
+
+            old_index = os.path.join(old_folder, PACK_INDEX_NAME)
+            keep = []
+            try:
+                with open(old_index, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except OSError:
+                return moved, archives
+            with open(os.path.join(new_folder, PACK_INDEX_NAME), "a", encoding="utf-8") as new_index:
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    name_ext = os.path.splitext(entry.get("name", ""))[1].lower().lstrip('.')
+                    if name_ext == file_extension:
+                        # 本文件夹的归档换成新名字；指向别处归档的引用原样带走
+                        entry["archive"] = renamed.get(entry["archive"], entry["archive"])
+                        new_index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                        moved.append((entry["name"], entry.get("size", 0)))
+                    else:
+                        keep.append(line if line.endswith("\n") else line + "\n")
+                new_index.flush()
+                os.fsync(new_index.fileno())
+            with open(old_index + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(keep)
+            os.replace(old_index + ".tmp", old_index)
+        return moved, archives
+
+    def retarget(self, folder, archives):
+        """把 folder 索引里指向已挪走归档的引用改到新位置，返回改了几条"""
+        index_path = os.path.join(folder, PACK_INDEX_NAME)
+        changed = 0
+        with self._lock:
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except OSError:
+                return changed
+            output = []
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                new_path = archives.get(entry.get("archive"))
+                if new_path is not None:
+                    entry["archive"] = new_path
+                    changed += 1
+                output.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            if changed:
+                with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+                    f.writelines(output)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(index_path + ".tmp", index_path)
+        return changed
+
+    def close_all(self):
+        """
+        批次结束：提交所有临时归档，返回 [(源文件或文件夹, 异常)]。
+        出错的源文件原样保留，调用方负责提示用户。文件名集合留给下一批，由 ResourceGovernor 裁剪。
+        """
+        with self._lock:
+            errors = self._errors
+            self._errors = []
+            for writer in self._writers.values():
+                errors.extend(self._commit(writer))
+            self._writers.clear()
+        return errors
+
+
+SMALL_FILE_PACKER = SmallFilePacker()
+RESOURCE_GOVERNOR.register_cache(SMALL_FILE_PACKER)
+
+
+def same_folder(a, b):
+    return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+
+def place_file(file_path, target_folder, extra_folders, config, reserved_folders=()):
+    """
+    把一个文件归档到主目标文件夹和附加目标文件夹，返回 (主目标中的位置, 已放置的附加目标, 失败列表)：
+    - 命中 pack_rules 的小文件写进主目标的滚动归档，附加目标记一条引用，
+      批次结束 SMALL_FILE_PACKER.close_all() 提交成功后才删除源文件；
+    - 其余文件移动到主目标，附加目标按 placement_mode 用链接（或复制）放置。
+
+    主目标失败时直接抛出；附加目标逐个处理，失败的记在 [(文件夹, 异常)] 里，不影响其余目标。
+    reserved_folders 为 admit_batch 已经预留好复制空间的附加目标。
+    """
+    extra_folders = [f for f in extra_folders or [] if not same_folder(f, target_folder)]
+    file_extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+    nbytes = os.path.getsize(file_path)
+    placed = []
+    failed = []
+
+    policy = get_pack_policy(file_path, config)
+    if policy is not None:
+        # 附加目标只在索引里引用主目标的归档；统计和删除源文件在 close_all 提交时完成
+        archive_path, _ = SMALL_FILE_PACKER.add(file_path, target_folder, policy, extra_folders)
+        return archive_path, extra_folders, failed
+
+    target_path = move_file_to_folder(file_path, target_folder)
+    USAGE_STATS.record(target_folder, file_extension, nbytes)
+    mode = config.get("placement_mode", "link")
+    headroom = space_headroom(config)
+    for folder in extra_folders:
+        reserved = any(same_folder(folder, r) for r in reserved_folders)
+        try:
+            link_file_to_folder(target_path, folder, mode, reserved, headroom)
+            USAGE_STATS.record(folder, file_extension, nbytes, intake=False)
+            placed.append(folder)
+        except Exception as e:
+            failed.append((folder, e))
+    return target_path, placed, failed
+
+
+# ===================== 使用统计（增量计数 + 后台校准） =====================
+
+STATS_NAME = "stats.json"
+
+
+def format_size(nbytes):
+    """把字节数格式化成 KB / MB / GB"""
+    size = float(nbytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class UsageStats:
+    """
+    每个目标文件夹、每种扩展名的文件数和字节数，以及每天的归档量。
+
+    计数由分类流程在移动文件时增量更新（record），不需要每次都去遍历目标文件夹；
+    计数存放在 array 里，按 (类别, 键) 分配槽位，占用很小，持久化到 app_dir 下的 stats.json。
+    后台会定期用 os.scandir 扫描目标文件夹（只看 fileHome 放文件的那一层）校准计数，
+    扫描进度随时写盘，程序重启后从没扫完的文件夹继续。
+    校准期间新增的计数记在 scan 的 delta / ext_delta 里，校准结束时加回扫描结果，不会丢。
+    """
+
+    KEEP_DAYS = 366
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()   # 分类流程和校准线程都会 save，写临时文件和改名要串行
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self._keys = []            # 槽位 -> (类别, 键)，类别为 "folder" 或 "ext"
+        self._slots = {}           # (类别, 键) -> 槽位
+        self._counts = array("q")
+        self._bytes = array("q")
+        self._days = {}            # "YYYY-MM-DD" -> [文件数, 字节数]
+        self._scan = None          # 未完成的校准进度
+        self._last_reconcile = 0.0
+
+    def _path(self):
+        return os.path.join(get_app_dir(), STATS_NAME)
+
+    def _slot(self, kind, key):
+        slot = self._slots.get((kind, key))
+        if slot is None:
+            slot = len(self._keys)
+            self._keys.append((kind, key))
+            self._slots[(kind, key)] = slot
+            self._counts.append(0)
+            self._bytes.append(0)
+        return slot
+
+    # ---------- 持久化 ----------
+
+    def load(self):
+        try:
+            with open(self._path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        with self._lock:
+            self._reset()
+            for (kind, key), count, nbytes in zip(data.get("keys", []), data.get("counts", []), data.get("bytes", [])):
+                slot = self._slot(kind, key)
+                self._counts[slot] = count
+                self._bytes[slot] = nbytes
+            self._days = data.get("days", {})
+            self._scan = data.get("scan")
+            self._last_reconcile = data.get("last_reconcile", 0.0)
+
+    def save(self):
+        # 在 _save_lock 里取快照，保证后写盘的一定是更新的数据
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps({
+                    "keys": [list(key) for key in self._keys],
+                    "counts": self._counts.tolist(),
+                    "bytes": self._bytes.tolist(),
+                    "days": self._days,
+                    "scan": self._scan,
+                    "last_reconcile": self._last_reconcile,
+                }, ensure_ascii=False)
+            path = self._path()
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            except Exception as e:
+                print(f"保存统计失败: {e}")
+
+    # ---------- 内存预算 ----------
+
+    # 估算每个槽位（键元组 + 字典项 + 两个计数）和每天一条记录的开销
+    SLOT_OVERHEAD = 200
+    DAY_OVERHEAD = 150
+
+    def cache_bytes(self):
+        with self._lock:
+            keys = sum(sys.getsizeof(key) for _, key in self._keys)
+            return keys + len(self._keys) * self.SLOT_OVERHEAD + len(self._days) * self.DAY_OVERHEAD
+
+    def trim_cache(self, max_bytes):
+        """
+        计数本身不能丢，这里只回收已经归零的槽位（迁移走或删掉规则后留下的旧文件夹 / 扩展名）。
+        校准进行中时不动，免得和扫描结果对不上。
+        """
+        if self.cache_bytes() <= max_bytes:
+            return
+        with self._lock:
+            if self._scan is not None:
+                return
+            keys = self._keys
+            counts = self._counts
+            nbytes = self._bytes
+            self._keys = []
+            self._slots = {}
+            self._counts = array("q")
+            self._bytes = array("q")
+            for slot, key in enumerate(keys):
+                if counts[slot] or nbytes[slot]:
+                    new_slot = self._slot(*key)
+                    self._counts[new_slot] = counts[slot]
+                    self._bytes[new_slot] = nbytes[slot]
+
+    # ---------- 增量更新 ----------
+
+    def record(self, folder, file_extension, nbytes, count=1, intake=True):
+        """
+        分类流程每放置一个文件调用一次；
+        迁移时用负数从旧文件夹扣除，intake=False 表示不计入当天的归档量。
+        """
+        folder = os.path.normpath(folder)
+        with self._lock:
+            slot = self._slot("folder", folder)
+            self._counts[slot] += count
+            self._bytes[slot] += nbytes
+            scan = self._scan
+            # 还没开始扫的文件夹，扫描时自然会看到这个文件；正在扫和已经扫过的要记下差额
+            current = scan is not None and folder == scan.get("current")
+            counted = scan is not None and (current or folder not in scan["pending"])
+            if current or (counted and folder in scan["folders"]):
+                delta = scan.setdefault("delta", {}).setdefault(folder, [0, 0])
+                delta[0] += count
+                delta[1] += nbytes
+            if not intake:
+                return
+            if counted:
+                delta = scan.setdefault("ext_delta", {}).setdefault(file_extension, [0, 0])
+                delta[0] += count
+                delta[1] += nbytes
+            slot = self._slot("ext", file_extension)
+            self._counts[slot] += count
+            self._bytes[slot] += nbytes
+            today = date.today().isoformat()
+            day = self._days.setdefault(today, [0, 0])
+            day[0] += count
+            day[1] += nbytes
+            if len(self._days) > self.KEEP_DAYS:
+                for old in sorted(self._days)[:-self.KEEP_DAYS]:
+                    del self._days[old]
+
+    def snapshot(self):
+        """返回 {"folders": [(文件夹, 数量, 字节)], "exts": [...], "days": [(日期, 数量, 字节)]}"""
+        with self._lock:
+            result = {"folders": [], "exts": []}
+            for slot, (kind, key) in enumerate(self._keys):
+                if self._counts[slot] or self._bytes[slot]:
+                    result[kind + "s"].append((key, self._counts[slot], self._bytes[slot]))
+            result["days"] = [(day, c, b) for day, (c, b) in sorted(self._days.items())]
+        result["folders"].sort(key=lambda item: -item[2])
+        result["exts"].sort(key=lambda item: -item[2])
+        return result
+
+    # ---------- 后台校准 ----------
+
+    def start_reconcile(self, folders, interval_hours=24, extras=None):
+        """
+        有未完成的校准，或距上次校准超过 interval_hours 时，在后台线程里校准。
+        已经在跑时什么都不做。
+        extras 为 {文件夹: [扩展名]}，表示该文件夹是这些扩展名的附加目标；
+        附加目标里的副本和 record(intake=False) 一样，不计入扩展名统计。
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        folders = sorted({os.path.normpath(f) for f in folders})
+        extras = {os.path.normpath(f): sorted(exts) for f, exts in (extras or {}).items()}
+        with self._lock:
+            if self._scan is None:
+                if time.time() - self._last_reconcile < interval_hours * 3600:
+                    return
+                self._scan = {"pending": folders, "folders": {}, "exts": {}, "extras": extras}
+        # 线程数到上限时这次先不跑，进度已记下，下次检查时再启动
+        self._thread = RESOURCE_GOVERNOR.start_thread(self._reconcile, "stats-reconcile")
+
+    def _reconcile(self):
+        while True:
+            with self._lock:
+                if not self._scan or not self._scan["pending"]:
+                    break
+                folder = self._scan["pending"][0]
+                self._scan["current"] = folder
+                self._scan.setdefault("delta", {}).pop(folder, None)
+
+            count, nbytes, exts = self._scan_folder(folder)
+
+            with self._lock:
+                self._scan["pending"].pop(0)
+                self._scan["current"] = None
+                self._scan["folders"][folder] = [count, nbytes]
+                skip = self._scan.get("extras", {}).get(folder, ())
+                for ext, (c, b) in exts.items():
+                    if ext in skip:
+                        continue
+                    total = self._scan["exts"].setdefault(ext, [0, 0])
+                    total[0] += c
+                    total[1] += b
+            # 每扫完一个文件夹就落盘，中途退出也能接着扫
+            self.save()
+
+        with self._lock:
+            scan = self._scan
+            if scan is None:
+                return
+            delta = scan.get("delta", {})
+            for folder, (count, nbytes) in scan["folders"].items():
+                extra_count, extra_bytes = delta.get(folder, (0, 0))
+                slot = self._slot("folder", folder)
+                self._counts[slot] = count + extra_count
+                self._bytes[slot] = nbytes + extra_bytes
+            exts = {}
+            for source in (scan["exts"], scan.get("ext_delta", {})):
+                for ext, (c, b) in source.items():
+                    total = exts.setdefault(ext, [0, 0])
+                    total[0] += c
+                    total[1] += b
+            for kind, key in list(self._keys):
+                if kind == "ext":
+                    exts.setdefault(key, [0, 0])
+            for ext, (count, nbytes) in exts.items():
+                slot = self._slot("ext", ext)
+                self._counts[slot] = count
+                self._bytes[slot] = nbytes
+            self._scan = None
+            self._last_reconcile = time.time()
+        self.save()
+
+    @staticmethod
+    def _scan_folder(folder):
+        """
+        用 os.scandir 扫一层目录，返回 (文件数, 字节数, {扩展名: [数量, 字节]})。
+        打包归档按索引里的原文件计数；每扫一批条目让出一下 CPU，保持低优先级。
+        """
+        count = 0
+        nbytes = 0
+        exts = {}
+
+        def add(name, size):
+            nonlocal count, nbytes
+            ext = os.path.splitext(name)[1].lower().lstrip('.')
+            count += 1
+            nbytes += size
+            total = exts.setdefault(ext, [0, 0])
+            total[0] += 1
+            total[1] += size
+
+        try:
+            with os.scandir(folder) as it:
+                for i, entry in enumerate(it):
+                    if i % 256 == 255:
+                        time.sleep(0.01)
+                    name = entry.name
+                    if name == PACK_INDEX_NAME or name.startswith("_packed_"):
+                        continue
+                    try:
+                        if entry.is_file():
+                            add(name, entry.stat().st_size)
+                    except OSError:
+                        continue
+        except OSError:
+            return 0, 0, {}
+
+        try:
+            with open(os.path.join(folder, PACK_INDEX_NAME), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    add(entry.get("name", ""), entry.get("size", 0))
+        except OSError:
+            pass
+
+        return count, nbytes, exts
+
+
+USAGE_STATS = UsageStats()
+RESOURCE_GOVERNOR.register_cache(USAGE_STATS)
+
+
+# ===================== 规则变更后的增量迁移 =====================
+
+MIGRATION_NAME = "migration.json"
+
+
+def diff_file_types(old_types, new_types):
+    """
+    比较新旧分类规则，返回目标文件夹发生变化的 [(扩展名, 旧文件夹, 新文件夹)]。
+    多目标规则按位置一一对应；被删掉的规则或文件夹不迁移，文件留在原处。
+    旧文件夹仍在新规则里（只是换了位置），或新文件夹本来就是目标时也不迁移，
+    否则调换顺序会让文件来回搬、还在用的附加目标会被搬空。
+    """
+    changes = []
+    for file_extension, old_rule in old_types.items():
+        old_folders = rule_folders(old_rule)
+        new_folders = rule_folders(new_types.get(file_extension))
+        for old_folder, new_folder in zip(old_folders, new_folders):
+            if any(same_folder(old_folder, folder) for folder in new_folders):
+                continue
+            if any(same_folder(new_folder, folder) for folder in old_folders):
+                continue
+            changes.append((file_extension, old_folder, new_folder))
+    return changes
+
+
+class RuleMigration:
+    """
+    把已经归档的文件从旧目标文件夹迁到新目标文件夹。
+
+    只扫描旧目标文件夹这一层（os.scandir），只挑变更规则对应扩展名的文件，不碰整个磁盘；
+    移动走 move_file_to_folder，同一磁盘上就是一次重命名，跨盘时先经过空间准入。
+    挪走的文件可能是规则里其他文件夹的符号链接 / 归档引用的目标，迁移完会把它们重新指向新位置。
+    待迁移的规则记在 app_dir 下的 migration.json 里，每完成一条就落盘；
+    文件一旦挪走就不在旧文件夹里了，所以中断后重新扫描旧文件夹即可接着迁移。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _path(self):
+        return os.path.join(get_app_dir(), MIGRATION_NAME)
+
+    def pending(self):
+        try:
+            with open(self._path(), "r", encoding="utf-8") as f:
+                return [tuple(change) for change in json.load(f)]
+        except Exception:
+            return []
+
+    def _save(self, changes):
+        path = self._path()
+        try:
+            if changes:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump([list(change) for change in changes], f, ensure_ascii=False, indent=4)
+                os.replace(path + ".tmp", path)
+            elif os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"保存迁移进度失败: {e}")
+
+    def add(self, changes):
+        with self._lock:
+            pending = self.pending()
+            for change in changes:
+                if tuple(change) not in pending:
+                    pending.append(tuple(change))
+            self._save(pending)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, on_finished=None):
+        """
+        在后台线程里迁移；on_finished(已迁移数, 失败数) 在后台线程里回调。
+        后台线程数已到上限时返回 False，调用方稍后再试。
+        """
+        if self.is_running() or not self.pending():
+            return True
+        self._thread = RESOURCE_GOVERNOR.start_thread(self._run, "rule-migration", on_finished)
+        return self._thread is not None
+
+    def _run(self, on_finished):
+        moved = 0
+        failed = 0
+        while True:
+            with self._lock:
+                pending = self.pending()
+            if not pending:
+                break
+            change = pending[0]
+            change_moved, change_failed = self.migrate(*change)
+            moved += change_moved
+            failed += change_failed
+            with self._lock:
+                pending = self.pending()
+                if change in pending:
+                    pending.remove(change)
+                self._save(pending)
+        USAGE_STATS.save()
+        if on_finished is not None:
+            on_finished(moved, failed)
+
+    @staticmethod
+    def migrate(file_extension, old_folder, new_folder):
+        """迁移一条规则，返回 (已迁移数, 失败数)"""
+        moved = 0
+        failed = 0
+        if not os.path.isdir(old_folder):
+            return moved, failed
+        # 迁移可能在规则又改过之后才继续；旧文件夹重新成了目标就不能再搬空它
+        config = load_config_file()
+        current = rule_folders(config.get("file_types", {}).get(file_extension))
+        if any(same_folder(old_folder, folder) for folder in current):
+            return moved, failed
+
+        packed, archives = SMALL_FILE_PACKER.relocate(file_extension, old_folder, new_folder)
+        for name, nbytes in packed:
+            USAGE_STATS.record(old_folder, file_extension, -nbytes, count=-1, intake=False)
+            USAGE_STATS.record(new_folder, file_extension, nbytes, intake=False)
+            moved += 1
+
+        jobs = []
+        with os.scandir(old_folder) as it:
+            for entry in it:
+                name = entry.name
+                if name == PACK_INDEX_NAME or name.startswith("_packed_"):
+                    continue
+                if os.path.splitext(name)[1].lower().lstrip('.') != file_extension:
+                    continue
+                if entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                    jobs.append((entry.path, new_folder))
+
+        admitted, refused = admit_batch(jobs, config)
+        failed += len(refused)
+        moved_paths = {}
+        for job in admitted:
+            try:
+                nbytes = os.lstat(job.file_path).st_size
+                target_path = move_file_to_folder(job.file_path, job.target_folder)
+                moved_paths[os.path.abspath(job.file_path)] = os.path.abspath(target_path)
+                USAGE_STATS.record(old_folder, file_extension, -nbytes, count=-1, intake=False)
+                USAGE_STATS.record(new_folder, file_extension, nbytes, intake=False)
+                moved += 1
+            except Exception as e:
+                print(f"迁移 {job.file_path} 失败: {e}")
+                failed += 1
+            finally:
+                release_job(job)
+
+        for folder in rule_folders(config.get("file_types", {}).get(file_extension)):
+            if not same_folder(folder, old_folder):
+                RuleMigration.repoint(folder, file_extension, moved_paths, archives)
+        return moved, failed
+
+    @staticmethod
+    def repoint(folder, file_extension, moved_paths, archives):
+        """把 folder 里指向已迁走文件的符号链接和归档引用改到新位置"""
+        if archives:
+            SMALL_FILE_PACKER.retarget(folder, archives)
+        if not moved_paths:
+            return
+        try:
+            with os.scandir(folder) as it:
+                links = [entry for entry in it if entry.is_symlink()
+                         and os.path.splitext(entry.name)[1].lower().lstrip('.') == file_extension]
+        except OSError:
+            return
+        for entry in links:
+            try:
+                link = os.readlink(entry.path)
+                new_target = moved_paths.get(os.path.abspath(os.path.join(folder, link)))
+                if new_target is None:
+                    continue
+                # 先在旁边建好新链接再原子替换，任何时刻链接都不会缺失
+                temp_path = create_unique(folder, f".{entry.name}.relink",
+                                          lambda path: os.symlink(new_target, path))
+                os.replace(temp_path, entry.path)
+            except OSError as e:
+                print(f"重新指向 {entry.path} 失败: {e}")
+
+
+RULE_MIGRATION = RuleMigration()
+
+
+# ===================== 拖放轨迹录制（用于压测回放，见 replay.py） =====================
+
+class TraceRecorder:
+    """
+    录制模式：把每一次拖放 / 分类事件按 JSON Lines 追加写入轨迹文件，
+    记录路径、大小、相对时间戳，开头附一份配置快照；录制途中规则变了会再记一条 config 事件。
+    开启 anonymize 后，路径的每一级名字都换成带盐的哈希，只保留扩展名，
+    这样用户机器上的轨迹可以放心带回来做回放压测。
+
+    配置（config.json 中的 trace_settings）：
+        enabled    是否录制，默认 False
+        path       轨迹文件路径，相对路径以 app_dir 为基准，默认 trace.jsonl
+        anonymize  是否匿名化路径，默认 True
+
+    事件先攒在内存缓冲里，满 FLUSH_EVENTS 条、关闭录制或被 ResourceGovernor 裁剪时才写盘，
+    一次拖进几万个文件时不会每条都 flush 一次。
+    """
+
+    FLUSH_EVENTS = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._file = None
+        self._path = None
+        self._start = 0.0
+        self._anonymize = True
+        self._salt = ""
+        self._snapshot = None
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def configure(self, config):
+        """
+        根据配置开启 / 关闭录制；路径不变时保持已有文件继续追加，
+        规则和上次快照不同时追加一条 config 事件，回放会从那一刻起改用新规则。
+        """
+        trace_settings = config.get("trace_settings", {})
+        if not trace_settings.get("enabled", False):
+            self.close()
+            return
+
+        path = trace_settings.get("path") or "trace.jsonl"
+        if not os.path.isabs(path):
+            path = os.path.join(get_app_dir(), path)
+        anonymize = bool(trace_settings.get("anonymize", True))
+
+        with self._lock:
+            reuse = self._file is not None and self._path == path and self._anonymize == anonymize
+        if reuse:
+            snapshot = self._config_snapshot(config)
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                self._write({
+                    "event": "config",
+                    "t": round(time.monotonic() - self._start, 6),
+                    "config": snapshot,
+                })
+            return
+        self.close()
+
+        try:
+            trace_file = open(path, "a", encoding="utf-8")
+        except Exception as e:
+            print(f"打开轨迹文件失败: {e}")
+            return
+
+        with self._lock:
+            self._file = trace_file
+            self._path = path
+            self._start = time.monotonic()
+            self._anonymize = anonymize
+            self._salt = os.urandom(8).hex() if anonymize else ""
+
+        self._snapshot = self._config_snapshot(config)
+        self._write({
+            "event": "start",
+            "t": 0.0,
+            "anonymized": anonymize,
+            "config": self._snapshot,
+        })
+
+    def _config_snapshot(self, config):
+        """回放需要的那部分配置，目标文件夹和溢出文件夹按同样的方式匿名化"""
+        space_settings = dict(config.get("space_settings", {}))
+        if space_settings.get("overflow_folder"):
+            space_settings["overflow_folder"] = self._anon_path(space_settings["overflow_folder"])
+        return {
+            "file_types": {
+                ext: [self._anon_path(folder) for folder in rule_folders(rule)]
+                for ext, rule in config.get("file_types", {}).items()
+            },
+            "space_settings": space_settings,
+            "placement_mode": config.get("placement_mode", "link"),
+            "pack_rules": config.get("pack_rules", {}),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                try:
+                    self._file.close()
+                except Exception:
+                    pass
+            self._file = None
+            self._path = None
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer and self._file is not None:
+            try:
+                self._file.write("".join(self._buffer))
+                self._file.flush()
+            except Exception as e:
+                print(f"写入轨迹失败: {e}")
+        self._buffer = []
+        self._buffer_bytes = 0
+
+    def cache_bytes(self):
+        return self._buffer_bytes
+
+    def trim_cache(self, max_bytes):
+        if self._buffer_bytes > max_bytes:
+            self.flush()
+
+    def record(self, event, file_path, **extra):
+        """记录一次事件；未开启录制时什么都不做"""
+        if self._file is None:
+            return
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = None
+        entry = {
+            "event": event,
+            "t": round(time.monotonic() - self._start, 6),
+            "path": self._anon_path(file_path),
+            "size": size,
+        }
+        for key, value in extra.items():
+            if key in ("target_folder", "target_path") and value:
+                value = self._anon_path(value)
+            entry[key] = value
+        self._write(entry)
+
+    def _anon_path(self, path):
+        if not self._anonymize or not path:
+            return path
+        drive, rest = os.path.splitdrive(path)
+        parts = [p for p in rest.replace("\\", "/").split("/") if p]
+        hashed = []
+        for i, part in enumerate(parts):
+            stem, ext = os.path.splitext(part) if i == len(parts) - 1 else (part, "")
+            digest = hashlib.sha1((self._salt + stem).encode("utf-8")).hexdigest()[:12]
+            hashed.append(digest + ext.lower())
+        return "/" + "/".join(hashed)
+
+    def _write(self, entry):
+        with self._lock:
+            if self._file is None:
+                return
+            line = json.dumps(entry, ensure_ascii=False) + "\n"
+            self._buffer.append(line)
+            self._buffer_bytes += sys.getsizeof(line)
+            if len(self._buffer) >= self.FLUSH_EVENTS:
+                self._flush()
+
+
+TRACE_RECORDER = TraceRecorder()
+RESOURCE_GOVERNOR.register_cache(TRACE_RECORDER)
+
+
 # ===================== 设置窗口 =====================
 
 class SettingsDialog(QDialog):
@@ -134,7 +1863,8 @@ class SettingsDialog(QDialog):
 
         # 排序后显示，列表更整齐
         for file_type in sorted(file_types.keys()):
-            folder_path = file_types[file_type]
+            # 多个目标文件夹用 ; 分隔显示
+            folder_path = "; ".join(rule_folders(file_types[file_type]))
 
             # 左侧标签：高亮显示扩展名
             label = QLabel(f".{file_type} 保存到：")
@@ -142,7 +1872,7 @@ class SettingsDialog(QDialog):
 
             # 输入框 + 浏览按钮
             line_edit = QLineEdit(folder_path)
-            line_edit.setPlaceholderText("选择或输入一个文件夹路径")
+            line_edit.setPlaceholderText("选择或输入文件夹路径，多个用 ; 分隔")
 
             browse_btn = QPushButton("选择...")
             browse_btn.setFixedWidth(72)
@@ -216,20 +1946,26 @@ class SettingsDialog(QDialog):
         if not line_edit:
             return
 
-        current_path = line_edit.text().strip() or os.path.expanduser("~")
+        current_path = line_edit.text().split(";")[0].strip() or os.path.expanduser("~")
         folder = QFileDialog.getExistingDirectory(
             self,
             f"选择 .{file_type} 文件要保存到的文件夹",
             current_path,
         )
         if folder:
-            line_edit.setText(folder)
+            # 只替换第一个文件夹，保留其余的附加目标
+            others = rule_folders(line_edit.text().split(";"))[1:]
+            line_edit.setText("; ".join([folder] + others))
 
     def save_config(self):
+        """保存设置，返回目标文件夹发生变化的规则（见 diff_file_types）"""
         config = load_config_file()
+        old_types = dict(config["file_types"])
         for file_type, line_edit in self.file_type_inputs.items():
-            config["file_types"][file_type] = line_edit.text().strip()
+            folders = rule_folders(line_edit.text().split(";"))
+            config["file_types"][file_type] = folders if len(folders) > 1 else "".join(folders)
         save_config_file(config)
+        return diff_file_types(old_types, config["file_types"])
 
 
 # ===================== 主窗口 =====================
@@ -241,6 +1977,9 @@ class FileOrganizerWindow(QMainWindow):
     TOP = 4
     BOTTOM = 8
 
+    # 规则迁移完成（已迁移数, 失败数），从后台线程发出
+    migration_finished = pyqtSignal(int, int)
+
     def __init__(self):
         super().__init__()
         self.init_ui()
@@ -254,6 +1993,30 @@ class FileOrganizerWindow(QMainWindow):
         self.resize_region = 0
         self.drag_position = None
 
+        # 拖放批次编号（轨迹录制用）
+        self.drop_count = 0
+
+        # 待分类队列：超出 max_queued_items 的部分落盘；上次没处理完的不再自动继续
+        self.pending_queue = SpillQueue(os.path.join(get_app_dir(), QUEUE_SPOOL_NAME))
+        self.draining = False
+
+        # 资源预算：托盘常驻时每分钟检查一次缓存和常驻内存，顺便把轨迹缓冲写盘
+        self.resource_timer = QTimer(self)
+        self.resource_timer.timeout.connect(self.enforce_resource_limits)
+        self.resource_timer.start(60 * 1000)
+
+        # 使用统计：启动一分钟后检查一次，之后每小时检查是否需要后台校准
+        USAGE_STATS.load()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.reconcile_statistics)
+        self.stats_timer.start(60 * 60 * 1000)
+        QTimer.singleShot(60 * 1000, self.reconcile_statistics)
+
+        # 上次没迁移完的规则，启动后继续
+        self.migration_finished.connect(self.on_migration_finished)
+        if RULE_MIGRATION.pending():
+            QTimer.singleShot(5 * 1000, self.start_migration)
+
     # ---------- 尺寸 & 位置 ----------
 
     def get_screen_size(self):
@@ -468,6 +2231,9 @@ class FileOrganizerWindow(QMainWindow):
         opacity = window_settings.get("opacity", 1.0)
         self.setWindowOpacity(opacity)
 
+        TRACE_RECORDER.configure(config)
+        RESOURCE_GOVERNOR.configure(config)
+
     def save_window_settings(self):
         config = load_config_file()
         ws = config.setdefault("window_settings", {})
@@ -484,9 +2250,10 @@ class FileOrganizerWindow(QMainWindow):
         event.accept()
 
     def hide_to_tray(self):
-        """点击圆形 × 时，只是隐藏到托盘"""
+        """点击圆形 × 时，只是隐藏到托盘，顺便释放缓存"""
         self.save_window_settings()
         self.hide()
+        RESOURCE_GOVERNOR.trim_caches()
 
     # ---------- 托盘 ----------
 
@@ -533,11 +2300,19 @@ class FileOrganizerWindow(QMainWindow):
         settings_action = QAction("设置", self)
         settings_action.triggered.connect(self.show_settings)
 
+        stats_action = QAction("统计", self)
+        stats_action.triggered.connect(self.show_statistics)
+
+        resource_action = QAction("资源占用", self)
+        resource_action.triggered.connect(self.show_resource_usage)
+
         quit_action = QAction("退出", self)
         quit_action.triggered.connect(self.quit_application)
 
         tray_menu.addAction(show_action)
         tray_menu.addAction(settings_action)
+        tray_menu.addAction(stats_action)
+        tray_menu.addAction(resource_action)
         tray_menu.addSeparator()
         tray_menu.addAction(quit_action)
 
@@ -590,10 +2365,104 @@ class FileOrganizerWindow(QMainWindow):
     def show_settings(self):
         dialog = SettingsDialog(self)
         if dialog.exec_() == QDialog.Accepted:
-            dialog.save_config()
+            changes = dialog.save_config()
             self.load_config()
+            if changes:
+                self.offer_migration(changes)
+
+    # ---------- 规则变更迁移 ----------
+
+    def offer_migration(self, changes):
+        lines = [f".{ext}：{old} → {new}" for ext, old, new in changes[:10]]
+        if len(changes) > 10:
+            lines.append(f"……等 {len(changes)} 条")
+
+        msg_box = QMessageBox(self)
+        msg_box.setWindowTitle("分类规则已修改")
+        msg_box.setText("以下规则的目标文件夹发生了变化：\n\n" + "\n".join(lines))
+        msg_box.setInformativeText("是否把已经归档到旧文件夹的文件迁移到新文件夹？\n迁移在后台进行，中途退出下次启动会继续。")
+        msg_box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        msg_box.setDefaultButton(QMessageBox.Yes)
+
+        if msg_box.exec_() == QMessageBox.Yes:
+            RULE_MIGRATION.add(changes)
+            self.start_migration()
+
+    def start_migration(self):
+        # 回调发生在后台线程，通过信号转回界面线程
+        if not RULE_MIGRATION.start(self.migration_finished.emit):
+            QTimer.singleShot(30 * 1000, self.start_migration)
+
+    def on_migration_finished(self, moved, failed):
+        self.tray_icon.showMessage(
+            "迁移完成",
+            f"已迁移 {moved} 个文件" + (f"，{failed} 个失败" if failed else ""),
+            QSystemTrayIcon.Warning if failed else QSystemTrayIcon.Information,
+            3000
+        )
+
+    # ---------- 使用统计 ----------
+
+    def reconcile_statistics(self):
+        config = load_config_file()
+        folders = set()
+        for rule in config.get("file_types", {}).values():
+            folders.update(rule_folders(rule))
+        interval = config.get("stats_settings", {}).get("reconcile_hours", 24)
+        extras = {}
+        for ext, rule in config.get("file_types", {}).items():
+            for folder in rule_folders(rule)[1:]:
+                extras.setdefault(folder, set()).add(ext)
+        USAGE_STATS.start_reconcile(folders, interval, extras)
+
+    def show_statistics(self):
+        stats = USAGE_STATS.snapshot()
+        lines = ["按目标文件夹："]
+        for folder, count, nbytes in stats["folders"][:10]:
+            lines.append(f"  {folder}：{count} 个，{format_size(nbytes)}")
+        lines.append("")
+        lines.append("按文件类型：")
+        for ext, count, nbytes in stats["exts"][:10]:
+            lines.append(f"  .{ext}：{count} 个，{format_size(nbytes)}")
+        lines.append("")
+        lines.append("最近 7 天归档：")
+        for day, count, nbytes in stats["days"][-7:]:
+            lines.append(f"  {day}：{count} 个，{format_size(nbytes)}")
+
+        msg_box = QMessageBox(self)
+        msg_box.setWindowTitle("fileHome 使用统计")
+        msg_box.setText("\n".join(lines))
+        msg_box.exec_()
+
+    # ---------- 资源占用 ----------
+
+    def enforce_resource_limits(self):
+        TRACE_RECORDER.flush()
+        RESOURCE_GOVERNOR.enforce()
+
+    def show_resource_usage(self):
+        usage = RESOURCE_GOVERNOR.usage()
+        limits = RESOURCE_GOVERNOR.limits
+        rss = format_size(usage["rss"]) if usage["rss"] is not None else "未知"
+        lines = [
+            f"进程内存：{rss} / {limits['max_rss_mb']} MB",
+            f"缓存：{format_size(usage['cache_bytes'])} / {limits['max_cache_mb']} MB",
+            f"排队（内存中）：{self.pending_queue.in_memory} / {limits['max_queued_items']}",
+            f"排队（已落盘）：{self.pending_queue.spilled}",
+            f"打开的文件：{usage['open_files']} / {limits['max_open_files']}",
+            f"后台线程：{usage['worker_threads']} / {limits['max_worker_threads']}",
+        ]
+
+        msg_box = QMessageBox(self)
+        msg_box.setWindowTitle("fileHome 资源占用")
+        msg_box.setText("\n".join(lines))
+        msg_box.exec_()
 
     def quit_application(self):
+        for path, e in SMALL_FILE_PACKER.close_all():
+            print(f"打包提交失败 {path}: {e}")
+        USAGE_STATS.save()
+        TRACE_RECORDER.close()
         self.tray_icon.hide()
         QApplication.quit()
 
@@ -644,46 +2513,134 @@ class FileOrganizerWindow(QMainWindow):
     def dropEvent(self, event: QDropEvent):
         self.drop_label.setStyleSheet(self.drop_normal_style)
 
-        urls = event.mimeData().urls()
+        self.drop_count += 1
+        self.enqueue_files(self._dropped_files(event.mimeData().urls(), self.drop_count))
+
+        event.acceptProposedAction()
+
+    @staticmethod
+    def _dropped_files(urls, batch):
+        """逐个产出拖进来的本地文件，直接流进 SpillQueue，不先在内存里攒一份完整的路径列表"""
         for url in urls:
             file_path = url.toLocalFile()
             if os.path.isfile(file_path):
-                self.organize_file(file_path)
+                TRACE_RECORDER.record("drop", file_path, batch=batch)
+                yield file_path
+
+    def enqueue_files(self, file_paths):
+        """放进待分类队列，由 drain_queue 在事件循环里分块处理，界面不会卡住"""
+        self.pending_queue.extend(file_paths, RESOURCE_GOVERNOR.limits["max_queued_items"])
+        if not self.draining:
+            self.draining = True
+            QTimer.singleShot(0, self.drain_queue)
+
+    def drain_queue(self):
+        chunk = self.pending_queue.pop_chunk(RESOURCE_GOVERNOR.limits["max_queued_items"])
+        if chunk:
+            self.organize_files(chunk)
+        if len(self.pending_queue):
+            QTimer.singleShot(0, self.drain_queue)
+        else:
+            self.draining = False
 
-        event.acceptProposedAction()
+    def organize_files(self, file_paths):
+        """整批分类：先按目标磁盘做空间准入，放不下的文件在复制前就被拒绝"""
+        config = load_config_file()
+        file_types = config.get("file_types", {})
+
+        jobs = []
+        for file_path in file_paths:
+            folders = get_target_folders(file_path, file_types)
+            if not folders:
+                # 交给 organize_file 提示“未知文件类型”
+                self.organize_file(file_path)
+            else:
+                jobs.append((file_path, folders[0], folders[1:]))
 
-    def organize_file(self, file_path):
         try:
-            config = load_config_file()
-            file_types = config.get("file_types", {})
-            file_extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+            admitted, refused = admit_batch(jobs, config)
+        except Exception as e:
+            self.tray_icon.showMessage(
+                "分类失败",
+                f"检查磁盘空间时出错: {str(e)}",
+                QSystemTrayIcon.Critical,
+                2000
+            )
+            return
 
-            if file_extension in file_types:
-                target_folder = file_types[file_extension]
+        if refused:
+            self.tray_icon.showMessage(
+                "磁盘空间不足",
+                f"{len(refused)} 个文件因目标磁盘空间不足或不可用未移动",
+                QSystemTrayIcon.Warning,
+                3000
+            )
 
-                # 确保目标文件夹存在
-                os.makedirs(target_folder, exist_ok=True)
+        try:
+            for job in admitted:
+                try:
+                    self.organize_file(
+                        job.file_path, job.target_folder,
+                        [folder for folder, _, _ in job.extras], config,
+                        [folder for folder, _, nbytes in job.extras if nbytes],
+                    )
+                finally:
+                    release_job(job)
+        finally:
+            pack_errors = SMALL_FILE_PACKER.close_all()
+            USAGE_STATS.save()
+            RESOURCE_GOVERNOR.enforce()
+            if pack_errors:
+                path, e = pack_errors[0]
+                self.tray_icon.showMessage(
+                    "打包未完成",
+                    f"{len(pack_errors)} 处打包提交失败，源文件已保留\n{os.path.basename(path)}: {str(e)}",
+                    QSystemTrayIcon.Warning,
+                    3000
+                )
 
-                # 移动文件
+    def organize_file(self, file_path, target_folder=None, extra_folders=None, config=None,
+                      reserved_folders=()):
+        """
+        移动到主目标文件夹；规则里有多个文件夹时，其余位置用链接（或复制）放置，
+        命中 pack_rules 的小文件则写进滚动归档，详见 place_file。
+        """
+        try:
+            if config is None:
+                config = load_config_file()
+            if target_folder is None:
+                folders = get_target_folders(file_path, config.get("file_types", {}))
+                if folders:
+                    target_folder, extra_folders = folders[0], folders[1:]
+
+            if target_folder is not None:
                 file_name = os.path.basename(file_path)
-                target_path = os.path.join(target_folder, file_name)
-
-                # 如果目标文件已存在，添加序号
-                counter = 1
-                base_name, ext = os.path.splitext(file_name)
-                while os.path.exists(target_path):
-                    target_path = os.path.join(target_folder, f"{base_name}_{counter}{ext}")
-                    counter += 1
-
-                shutil.move(file_path, target_path)
-
-                self.tray_icon.showMessage(
-                    "文件分类成功",
-                    f"已将 {file_name} 移动到 {target_folder}",
-                    QSystemTrayIcon.Information,
-                    2000
+                if TRACE_RECORDER.enabled:
+                    TRACE_RECORDER.record("organize", file_path, target_folder=target_folder)
+                _, placed, failed = place_file(
+                    file_path, target_folder, extra_folders, config, reserved_folders
                 )
+
+                message = f"已将 {file_name} 移动到 {target_folder}"
+                if placed:
+                    message += f"，并放置到 {'、'.join(placed)}"
+                if failed:
+                    errors = "；".join(f"{folder}: {e}" for folder, e in failed)
+                    self.tray_icon.showMessage(
+                        "部分完成",
+                        f"{message}，但放置到以下位置失败：{errors}",
+                        QSystemTrayIcon.Warning,
+                        3000
+                    )
+                else:
+                    self.tray_icon.showMessage(
+                        "文件分类成功",
+                        message,
+                        QSystemTrayIcon.Information,
+                        2000
+                    )
             else:
+                file_extension = os.path.splitext(file_path)[1].lower().lstrip('.')
                 self.tray_icon.showMessage(
                     "未知文件类型",
                     f"未找到 .{file_extension} 文件的分类规则",
@@ -0,0 +1,243 @@
+"""
+拖放轨迹回放工具：把 TraceRecorder 录下的轨迹在一个临时目录里重建出来，
+用稀疏文件模拟原始大小，再按原速度或 N 倍速送进分类流程，统计排队延迟和吞吐。
+
+用法：
+    python replay.py trace.jsonl
+    python replay.py trace.jsonl --speed 10 --scratch D:\\replay
+    python replay.py trace.jsonl --speed 0          # 不等待，尽快回放
+    python replay.py trace.jsonl --dest E:\\replay  # 目标放到另一块盘，模拟跨盘复制
+
+Windows 上会用 FSCTL_SET_SPARSE 把源文件标记为稀疏文件（需要 NTFS / ReFS）；
+临时目录所在的文件系统不支持稀疏文件时，会先检查剩余空间，放不下就直接退出。
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from main import SMALL_FILE_PACKER, admit_batch, place_file, release_job, rule_folders
+
+
+def load_trace(trace_path):
+    """
+    读取轨迹，返回 (配置快照, 事件列表)；多段录制时只取最后一段。
+    录制途中的 config 事件保留在事件列表里，回放时按时间切换规则。
+    """
+    config = {}
+    events = []
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry.get("event") == "start":
+                config = entry.get("config", {})
+                events = []
+            else:
+                events.append(entry)
+    return config, events
+
+
+def scratch_path(root, recorded_path):
+    """把录制的路径（可能是 Windows 路径 / 匿名路径）映射到 root 下"""
+    parts = [p for p in re.split(r"[\\/]+", recorded_path) if p]
+    parts = [p.replace(":", "") or "_" for p in parts]
+    return os.path.join(root, *parts)
+
+
+# Windows 上 truncate 只会分配真实空间，要先用这个 ioctl 把文件标记为稀疏
+FSCTL_SET_SPARSE = 0x000900C4
+
+
+def _mark_sparse(f):
+    """把打开的文件标记为稀疏文件；非 Windows 平台 truncate 本身就是稀疏的"""
+    if sys.platform != "win32":
+        return True
+    try:
+        import ctypes
+        import msvcrt
+        from ctypes import wintypes
+
+        handle = wintypes.HANDLE(msvcrt.get_osfhandle(f.fileno()))
+        returned = wintypes.DWORD()
+        return bool(ctypes.windll.kernel32.DeviceIoControl(
+            handle, FSCTL_SET_SPARSE, None, 0, None, 0, ctypes.byref(returned), None
+        ))
+    except Exception:
+        return False
+
+
+def make_sparse_file(path, size):
+    """创建指定大小的稀疏文件，返回它是否真的没有占用磁盘空间"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        sparse = _mark_sparse(f)
+        f.truncate(size or 0)
+    blocks = getattr(os.stat(path), "st_blocks", None)
+    if blocks is not None:
+        sparse = not size or blocks * 512 < size
+    return sparse
+
+
+def build_replay_config(snapshot, dest_root):
+    """把录制的配置快照映射到回放目录下（包括溢出文件夹，回放不会往真实目录里写文件）"""
+    file_types = {
+        ext: [scratch_path(dest_root, folder) for folder in rule_folders(rule)]
+        for ext, rule in snapshot.get("file_types", {}).items()
+    }
+    file_types = {ext: folders for ext, folders in file_types.items() if folders}
+    space_settings = dict(snapshot.get("space_settings", {}))
+    if space_settings.get("overflow_folder"):
+        space_settings["overflow_folder"] = scratch_path(dest_root, space_settings["overflow_folder"])
+    return dict(snapshot, file_types=file_types, space_settings=space_settings)
+
+
+def build_batches(events):
+    """把 drop 事件按批次号分组；旧轨迹没有 drop 时退回按 organize 事件逐个回放"""
+    drops = [e for e in events if e.get("event") == "drop"]
+    if not drops:
+        drops = [dict(e, batch=i) for i, e in enumerate(events) if e.get("event") == "organize"]
+
+    batches = []
+    index = {}
+    for entry in drops:
+        key = entry.get("batch")
+        if key not in index:
+            index[key] = len(batches)
+            batches.append({"t": entry.get("t", 0.0), "entries": []})
+        batches[index[key]]["entries"].append(entry)
+    return batches
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[k]
+
+
+def replay(trace_path, scratch_root, dest_root, speed):
+    config, events = load_trace(trace_path)
+    batches = build_batches(events)
+    if not batches:
+        print("轨迹中没有可回放的事件")
+        return
+
+    src_root = os.path.join(scratch_root, "src")
+    replay_config = build_replay_config(config, dest_root)
+    config_events = [e for e in events if e.get("event") == "config"]
+
+    # 先把所有源文件建好，计时只覆盖分类流程本身
+    entries = [entry for batch in batches for entry in batch["entries"]]
+    remaining = sum(entry.get("size") or 0 for entry in entries)
+    dense = False
+    for entry in entries:
+        entry["local_path"] = scratch_path(os.path.join(src_root, str(id(entry))), entry["path"])
+        sparse = make_sparse_file(entry["local_path"], entry.get("size"))
+        remaining -= entry.get("size") or 0
+        if not sparse and not dense:
+            # 不支持稀疏文件时每个文件都会真实占用空间，先确认放得下
+            dense = True
+            free = shutil.disk_usage(src_root).free
+            if remaining > free:
+                raise SystemExit(
+                    f"临时目录所在文件系统不支持稀疏文件，回放还需要 {remaining / 1024 ** 3:.1f} GB，"
+                    f"但只剩 {free / 1024 ** 3:.1f} GB，请用 --scratch 换到 NTFS 等支持稀疏文件的磁盘"
+                )
+
+    latencies = []
+    service_times = []
+    moved = 0
+    refused = 0
+    skipped = 0
+    total_bytes = 0
+
+    start = time.monotonic()
+    first_t = batches[0]["t"]
+    for batch in batches:
+        due = (batch["t"] - first_t) / speed if speed > 0 else 0.0
+        delay = due - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+        begin = time.monotonic()
+
+        while config_events and config_events[0].get("t", 0.0) <= batch["t"]:
+            replay_config = build_replay_config(config_events.pop(0).get("config", {}), dest_root)
+        file_types = replay_config["file_types"]
+
+        jobs = []
+        for entry in batch["entries"]:
+            ext = os.path.splitext(entry["local_path"])[1].lower().lstrip(".")
+            if ext in file_types:
+                jobs.append((entry["local_path"], file_types[ext][0], file_types[ext][1:]))
+            else:
+                skipped += 1
+
+        admitted, refused_jobs = admit_batch(jobs, replay_config)
+        refused += len(refused_jobs)
+        for job in admitted:
+            item_start = time.monotonic()
+            try:
+                size = os.path.getsize(job.file_path)
+                _, _, failed = place_file(
+                    job.file_path, job.target_folder,
+                    [folder for folder, _, _ in job.extras], replay_config,
+                    [folder for folder, _, nbytes in job.extras if nbytes],
+                )
+                for folder, e in failed:
+                    print(f"回放放置到 {folder} 失败: {e}")
+                moved += 1
+                total_bytes += size
+            except Exception as e:
+                print(f"回放移动失败: {e}")
+            finally:
+                release_job(job)
+            done = time.monotonic()
+            service_times.append(done - item_start)
+            # 排队延迟：从“本应到达”的时刻到这个文件处理完
+            latencies.append(done - start - due)
+
+        for path, e in SMALL_FILE_PACKER.close_all():
+            print(f"回放打包提交失败 {path}: {e}")
+        if begin - start - due > 0.5:
+            print(f"警告：批次落后计划 {begin - start - due:.2f}s")
+
+    elapsed = time.monotonic() - start
+    print(f"批次数: {len(batches)}  已移动: {moved}  空间不足拒绝: {refused}  无规则跳过: {skipped}")
+    print(f"总耗时: {elapsed:.3f}s  回放倍速: {speed if speed > 0 else '不限'}")
+    if elapsed > 0:
+        print(f"吞吐: {moved / elapsed:.1f} 个/秒, {total_bytes / elapsed / 1024 / 1024:.1f} MB/秒（按逻辑大小）")
+    print(f"排队延迟 p50={percentile(latencies, 50) * 1000:.1f}ms "
+          f"p95={percentile(latencies, 95) * 1000:.1f}ms "
+          f"max={max(latencies, default=0) * 1000:.1f}ms")
+    print(f"单文件处理 p50={percentile(service_times, 50) * 1000:.2f}ms "
+          f"p95={percentile(service_times, 95) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放 fileHome 拖放轨迹")
+    parser.add_argument("trace", help="录制得到的 trace.jsonl")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示不等待（默认 1）")
+    parser.add_argument("--scratch", default=None, help="重建源文件的临时目录（默认自动创建并在结束后删除）")
+    parser.add_argument("--dest", default=None, help="目标文件夹的根目录（默认在 scratch 下）")
+    args = parser.parse_args()
+
+    cleanup = args.scratch is None
+    scratch_root = args.scratch or tempfile.mkdtemp(prefix="filehome_replay_")
+    dest_root = args.dest or os.path.join(scratch_root, "dest")
+    try:
+        replay(args.trace, scratch_root, dest_root, args.speed)
+    finally:
+        if cleanup:
+            shutil.rmtree(scratch_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())